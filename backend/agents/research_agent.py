@@ -4,14 +4,27 @@ Orchestrates the complete workflow: PDF ingestion -> Structural abstraction ->
 Embedding & Storage -> Retrieval -> Explanation
 """
 import uuid
+import logging
 import json
-from typing import Dict, Any, List, Optional
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import BinaryIO, Dict, Any, List, Optional, Tuple, Union
 from datetime import datetime
 
-from database.db import Database
+import numpy as np
+
+from config import Config
+from database.db import get_client
 from services.pdf_processor import PDFProcessor
-from services.keywords_gateway import KeywordsGateway
+from services.keywords_gateway import get_gateway
 from services.embedding_service import EmbeddingService
+from services.vector_index import PaperIndex, to_float32
+
+logger = logging.getLogger(__name__)
 
 class ResearchAgent:
     """
@@ -21,21 +34,106 @@ class ResearchAgent:
     
     def __init__(self):
         self.pdf_processor = PDFProcessor()
-        self.keywords_gateway = KeywordsGateway()
+        self.keywords_gateway = get_gateway()
         self.embedding_service = EmbeddingService()
-        self.db = Database.get_client()
+        self.db = get_client()
+        self.paper_index = PaperIndex(self.db)
+        
+        # Background ingestion queue for asynchronous uploads. Job status is
+        # per-process memory, so ?async=true needs a single-process deployment.
+        # Failed jobs are kept (oldest first) only until FAILED_JOB_TTL expires.
+        self._executor = ThreadPoolExecutor(max_workers=Config.INGEST_WORKERS)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._failed_jobs: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+        
+        # Ad-hoc query schemas are embedded once per distinct set of key fields
+        self._embed_key_fields = lru_cache(maxsize=256)(self._embed_key_fields_uncached)
+        
+        # In-process layer over the explanations table
+        self._explain_cached = lru_cache(maxsize=1024)(self._explain_uncached)
     
-    def process_paper(
+    def submit_paper(
         self,
-        pdf_file: bytes,
+        pdf_file: BinaryIO,
         title: Optional[str] = None
+    ) -> str:
+        """
+        Queue a paper for processing in the background.
+        
+        Args:
+            pdf_file: PDF file object (must stay open after the request ends)
+            title: Optional paper title
+            
+        Returns:
+            The paper_id the paper will be stored under
+        """
+        if not pdf_file:
+            raise ValueError("pdf_file is required")
+        
+        paper_id = str(uuid.uuid4())
+        with self._jobs_lock:
+            self._jobs[paper_id] = {"status": "processing"}
+        
+        self._executor.submit(self._run_job, paper_id, pdf_file, title)
+        return paper_id
+    
+    def get_job_status(self, paper_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the status of a queued paper.
+        
+        Returns:
+            {"status": "processing"} or {"status": "failed", "error": ...};
+            None once the paper is stored, once a failure has expired, or if it
+            was never queued (by this process)
+        """
+        with self._jobs_lock:
+            self._prune_failed_jobs()
+            if paper_id in self._failed_jobs:
+                return self._failed_jobs[paper_id][1]
+            return self._jobs.get(paper_id)
+    
+    def _run_job(self, paper_id: str, pdf_file: BinaryIO, title: Optional[str]):
+        """Run the full pipeline for a queued paper and record the outcome."""
+        try:
+            self.process_paper(pdf_file=pdf_file, title=title, paper_id=paper_id)
+        except Exception as e:
+            with self._jobs_lock:
+                self._jobs.pop(paper_id, None)
+                self._failed_jobs[paper_id] = (
+                    time.monotonic() + Config.FAILED_JOB_TTL,
+                    {"status": "failed", "error": str(e)}
+                )
+                self._prune_failed_jobs()
+            return
+        
+        # Stored papers are served from the database from now on
+        with self._jobs_lock:
+            self._jobs.pop(paper_id, None)
+    
+    def _prune_failed_jobs(self):
+        """Drop expired failed jobs. Caller must hold _jobs_lock."""
+        # The TTL is constant, so insertion order is expiry order
+        now = time.monotonic()
+        while self._failed_jobs:
+            expires_at, _ = next(iter(self._failed_jobs.values()))
+            if expires_at >= now:
+                break
+            self._failed_jobs.popitem(last=False)
+    
+    def process_paper(
+        self,
+        pdf_file: BinaryIO,
+        title: Optional[str] = None,
+        paper_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Complete pipeline: Process a paper through all agent steps.
         
         Args:
-            pdf_file: PDF file bytes
+            pdf_file: Seekable PDF file object
             title: Optional paper title
+            paper_id: Optional pre-assigned paper ID (generated if omitted)
             
         Returns:
             Dictionary with paper_id and processing metadata
@@ -43,7 +141,7 @@ class ResearchAgent:
         if not pdf_file:
             raise ValueError("pdf_file is required")
         
-        paper_id = str(uuid.uuid4())
+        paper_id = paper_id or str(uuid.uuid4())
         trace = {
             "paper_id": paper_id,
             "steps": [],
@@ -52,7 +150,7 @@ class ResearchAgent:
         
         try:
             # Step A: PDF Ingestion
-            print(f"[STEP A] PDF Ingestion for paper {paper_id}")
+            logger.info("[STEP A] PDF Ingestion for paper %s", paper_id)
             pdf_data = self.pdf_processor.extract_text_from_pdf(pdf_file, title)
             source = "upload"
             source_id = None
@@ -69,9 +167,9 @@ class ResearchAgent:
             })
             
             # Step B: Structural Abstraction
-            print(f"[STEP B] Structural Abstraction for paper {paper_id}")
+            logger.info("[STEP B] Structural Abstraction for paper %s", paper_id)
             abstraction_result = self.keywords_gateway.structural_abstraction(
-                paper_text=full_text[:10000],  # Limit for token efficiency
+                paper_text=full_text,  # Truncated to ABSTRACTION_INPUT_TOKENS by the gateway
                 paper_title=title
             )
             
@@ -90,23 +188,21 @@ class ResearchAgent:
             })
             
             # Step C: Embedding & Storage
-            print(f"[STEP C] Embedding & Storage for paper {paper_id}")
+            logger.info("[STEP C] Embedding & Storage for paper %s", paper_id)
             embedding = self.embedding_service.embed_schema(schema)
             
-            # Store in database
-            self._store_paper(
+            # Store paper and raw chunks in database (single transaction)
+            self._store_paper_with_chunks(
                 paper_id=paper_id,
                 title=title,
                 domain=schema.get("domain", "unknown"),
                 source=source,
                 source_id=source_id,
                 schema=schema,
-                embedding=embedding
+                embedding=embedding,
+                chunks=chunks
             )
             
-            # Store raw chunks in database (must be after paper creation due to FK)
-            self._store_chunks(paper_id, chunks)
-            
             trace["steps"].append({
                 "step": "embedding_storage",
                 "status": "success",
@@ -125,14 +221,15 @@ class ResearchAgent:
                 "step": "processing",
                 "error": str(e)
             })
-            print(f"[ERROR] Processing failed: {e}")
+            logger.error("Processing failed: %s", e)
             raise
     
     def find_analogous_papers(
         self,
         query_schema: Dict[str, Any],
         top_k: int = 5,
-        exclude_domain: Optional[str] = None
+        exclude_domain: Optional[str] = None,
+        exclude_id: Optional[str] = None
     ) -> List[Dict[str, Any]]:
         """
         Step D: Structural Retrieval
@@ -142,73 +239,225 @@ class ResearchAgent:
             query_schema: Structural schema to search for
             top_k: Number of results to return
             exclude_domain: Optional domain to exclude (to find cross-disciplinary matches)
+            exclude_id: Optional paper ID to leave out (e.g. the query paper itself)
             
         Returns:
             List of matched papers with similarity scores
         """
-        print(f"[STEP D] Structural Retrieval (top_k={top_k})")
+        # Generate (or reuse) embedding for query schema
+        key = (
+            query_schema.get("optimization_goal", ""),
+            tuple(query_schema.get("constraints", [])),
+            tuple(query_schema.get("state_variables", [])),
+            tuple(query_schema.get("failure_modes", []))
+        )
+        query_embedding = self._embed_key_fields(key)
         
-        # Generate embedding for query schema
-        query_embedding = self.embedding_service.embed_schema(query_schema)
+        return self.find_analogous_by_embedding(query_embedding, top_k, exclude_domain, exclude_id)
+    
+    def find_analogous_by_embedding(
+        self,
+        query_embedding: Union[List[float], str],
+        top_k: int = 5,
+        exclude_domain: Optional[str] = None,
+        exclude_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Step D: Structural Retrieval from an existing embedding.
+        Use this for stored papers to skip re-embedding their schema.
         
-        # Build query
-        # Use Supabase RPC or direct SQL for vector similarity search
-        # Note: Supabase Python client may need custom SQL for pgvector
+        Args:
+            query_embedding: Unit-length embedding (list or pgvector string)
+            top_k: Number of results to return
+            exclude_domain: Optional domain to exclude (to find cross-disciplinary matches)
+            exclude_id: Optional paper ID to leave out (e.g. the query paper itself)
+            
+        Returns:
+            List of matched papers with similarity scores
+        """
+        logger.info("[STEP D] Structural Retrieval (top_k=%s)", top_k)
+        
+        # Top-k search runs in Postgres against the HNSW index
+        # (see migrations/002_hnsw_match_papers.sql)
+        try:
+            # One extra row so dropping exclude_id still leaves top_k
+            response = self.db.rpc("match_papers", {
+                "query_embedding": query_embedding,
+                "k": top_k + 1 if exclude_id else top_k,
+                "exclude_domain": exclude_domain
+            }).execute()
+        except Exception as e:
+            logger.warning("match_papers RPC failed, falling back to in-memory search: %s", e)
+            if PaperIndex.is_available():
+                return self.paper_index.search(query_embedding, top_k, exclude_domain, exclude_id)
+            return self._brute_force_search(query_embedding, top_k, exclude_domain, exclude_id)
+        
+        matches = self._format_rpc_matches(response.data)
+        if exclude_id:
+            matches = [m for m in matches if m["paper_id"] != exclude_id]
+        return matches[:top_k]
+    
+    def find_analogous_to_paper(
+        self,
+        paper_id: str,
+        top_k: int = 5,
+        exclude_domain: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Step D: Structural Retrieval for a stored paper.
+        The paper's embedding is looked up inside Postgres and never
+        transferred to or parsed in Python.
+        
+        Args:
+            paper_id: ID of the stored query paper
+            top_k: Number of results to return
+            exclude_domain: Optional domain to exclude (to find cross-disciplinary matches)
+            
+        Returns:
+            List of matched papers with similarity scores
+        """
+        logger.info("[STEP D] Structural Retrieval for paper %s (top_k=%s)", paper_id, top_k)
         
-        # For now, we'll use a workaround with the Supabase client
-        # In production, you'd use a Postgres function or direct SQL
+        try:
+            response = self.db.rpc("match_papers_to_paper", {
+                "source_paper_id": paper_id,
+                "k": top_k,
+                "exclude_domain": exclude_domain
+            }).execute()
+        except Exception as e:
+            logger.warning("match_papers_to_paper RPC failed, searching from fetched embedding: %s", e)
+            response = self.db.table("papers").select(
+                "structural_schema, structural_embedding"
+            ).eq("id", paper_id).execute()
+            if not response.data:
+                raise ValueError(f"Paper {paper_id} not found")
+            
+            paper = response.data[0]
+            # match_papers_to_paper never returns the source paper; neither may the fallbacks
+            if paper.get("structural_embedding"):
+                return self.find_analogous_by_embedding(
+                    paper["structural_embedding"], top_k, exclude_domain, exclude_id=paper_id
+                )
+            return self.find_analogous_papers(
+                paper["structural_schema"], top_k, exclude_domain, exclude_id=paper_id
+            )
         
-        # Get all papers (this is inefficient but works for demo)
-        # In production, use proper vector similarity search
-        response = self.db.table("papers").select("*").execute()
-        all_papers = response.data
+        return self._format_rpc_matches(response.data)
+    
+    def _format_rpc_matches(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Convert match_papers* RPC rows to the API match format."""
+        return [
+            {
+                "paper_id": row["id"],
+                "title": row.get("title"),
+                "domain": row.get("domain"),
+                "schema": row.get("structural_schema"),
+                "similarity_score": float(row["similarity"])
+            }
+            for row in rows
+        ]
+    
+    def _embed_key_fields_uncached(
+        self,
+        key: Tuple[str, Tuple[str, ...], Tuple[str, ...], Tuple[str, ...]]
+    ) -> List[float]:
+        """Embed a schema given its (goal, constraints, state_variables, failure_modes) key."""
+        optimization_goal, constraints, state_variables, failure_modes = key
+        return self.embedding_service.embed_schema({
+            "optimization_goal": optimization_goal,
+            "constraints": list(constraints),
+            "state_variables": list(state_variables),
+            "failure_modes": list(failure_modes)
+        })
+    
+    def _brute_force_search(
+        self,
+        query_embedding: Union[List[float], str],
+        top_k: int,
+        exclude_domain: Optional[str] = None,
+        exclude_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Fallback for databases without the match_papers RPC when faiss is
+        not installed. Fetches all papers and computes cosine similarity in Python.
+        """
+        query = self.db.table("papers").select(
+            "id, title, domain, structural_schema, structural_embedding"
+        )
         
-        # Filter by domain if needed
+        # Filter by domain in Postgres so excluded papers are never transferred.
+        # neq alone would also drop NULL domains; match_papers keeps them
+        # (IS DISTINCT FROM), so include them explicitly. The value is quoted
+        # because or_() filters are comma-separated.
         if exclude_domain:
-            all_papers = [p for p in all_papers if p.get("domain") != exclude_domain]
+            quoted = exclude_domain.replace("\\", "\\\\").replace('"', '\\"')
+            query = query.or_(f'domain.is.null,domain.neq."{quoted}"')
+        if exclude_id:
+            query = query.neq("id", exclude_id)
         
-        # Compute cosine similarity (simplified - in production use pgvector operators)
-        import numpy as np
-        query_vec = np.array(query_embedding)
+        response = query.execute()
+        papers = [p for p in response.data if p.get("structural_embedding")]
+        if not papers:
+            return []
         
-        similarities = []
-        for paper in all_papers:
-            if not paper.get("structural_embedding"):
-                continue
-            
-            paper_embedding = paper["structural_embedding"]
-            if isinstance(paper_embedding, str):
-                paper_embedding = json.loads(paper_embedding)
-            
-            paper_vec = np.array(paper_embedding)
-            
-            # Cosine similarity
-            dot_product = np.dot(query_vec, paper_vec)
-            norm_query = np.linalg.norm(query_vec)
-            norm_paper = np.linalg.norm(paper_vec)
-            
-            if norm_query > 0 and norm_paper > 0:
-                similarity = dot_product / (norm_query * norm_paper)
-                similarities.append({
-                    "paper": paper,
-                    "similarity": float(similarity)
-                })
+        # Stack all embeddings once so similarity is a single matrix-vector product
+        # float32 halves the bytes moved per score compared to NumPy's float64 default
+        matrix = np.stack([to_float32(p["structural_embedding"]) for p in papers])
+        query_vec = to_float32(query_embedding)
+        
+        # Embeddings are stored unit-length (EmbeddingService normalizes them),
+        # so cosine similarity is a plain dot product
+        sims = matrix @ query_vec
         
-        # Sort by similarity and return top_k
-        similarities.sort(key=lambda x: x["similarity"], reverse=True)
-        top_matches = similarities[:top_k]
+        # Partial selection of the top_k in O(N), then sort only those k
+        k = min(top_k, len(sims))
+        if k <= 0:
+            return []
+        top_idx = np.argpartition(-sims, k - 1)[:k]
+        top_idx = top_idx[np.argsort(-sims[top_idx])]
         
         return [
             {
-                "paper_id": match["paper"]["id"],
-                "title": match["paper"].get("title"),
-                "domain": match["paper"].get("domain"),
-                "schema": match["paper"].get("structural_schema"),
-                "similarity_score": match["similarity"]
+                "paper_id": papers[i]["id"],
+                "title": papers[i].get("title"),
+                "domain": papers[i].get("domain"),
+                "schema": papers[i].get("structural_schema"),
+                "similarity_score": float(sims[i])
             }
-            for match in top_matches
+            for i in top_idx
         ]
     
+    def backfill_embeddings(self, batch_size: int = 100) -> int:
+        """
+        Embed stored papers whose structural_embedding is missing
+        (e.g. after changing EMBEDDING_DIM).
+        
+        Args:
+            batch_size: Number of schemas embedded per API call
+            
+        Returns:
+            Number of papers updated
+        """
+        response = self.db.table("papers").select("id, structural_schema").is_(
+            "structural_embedding", "null"
+        ).execute()
+        papers = response.data
+        
+        for start in range(0, len(papers), batch_size):
+            batch = papers[start:start + batch_size]
+            embeddings = self.embedding_service.embed_schemas(
+                [p["structural_schema"] for p in batch]
+            )
+            for paper, embedding in zip(batch, embeddings):
+                self.db.table("papers").update(
+                    {"structural_embedding": embedding}
+                ).eq("id", paper["id"]).execute()
+        
+        # Rebuild the in-memory fallback index with the new vectors
+        self.paper_index.invalidate()
+        logger.info("Backfilled embeddings for %s papers", len(papers))
+        return len(papers)
+    
     def generate_explanation_for_match(
         self,
         source_schema: Dict[str, Any],
@@ -225,7 +474,32 @@ class ResearchAgent:
         Returns:
             Dictionary with explanation and metadata
         """
-        print(f"[STEP E] Explanation Generation for paper {target_paper_id}")
+        logger.info("[STEP E] Explanation Generation for paper %s", target_paper_id)
+        
+        # Canonical JSON makes equal schemas share a cache entry regardless of key order
+        source_json = json.dumps(source_schema, sort_keys=True, separators=(",", ":"))
+        result = self._explain_cached(source_json, target_paper_id)
+        return {**result, "metadata": dict(result["metadata"])}
+    
+    def _explain_uncached(self, source_json: str, target_paper_id: str) -> Dict[str, Any]:
+        """
+        Look up a stored explanation, generating and storing it on a miss
+        (see migrations/008_explanations_cache.sql).
+        """
+        source_hash = hashlib.sha256(source_json.encode()).hexdigest()
+        
+        try:
+            cached = self.db.table("explanations").select("explanation, metadata").eq(
+                "source_hash", source_hash
+            ).eq("target_paper_id", target_paper_id).execute()
+            if cached.data:
+                return {
+                    "explanation": cached.data[0]["explanation"],
+                    "metadata": {**(cached.data[0].get("metadata") or {}), "cached": True},
+                    "target_paper_id": target_paper_id
+                }
+        except Exception as e:
+            logger.warning("Explanation cache lookup failed: %s", e)
         
         # Fetch target paper schema
         response = self.db.table("papers").select("structural_schema").eq("id", target_paper_id).execute()
@@ -236,31 +510,27 @@ class ResearchAgent:
         
         # Generate explanation
         explanation_result = self.keywords_gateway.generate_explanation(
-            source_schema=source_schema,
+            source_schema=json.loads(source_json),
             target_schema=target_schema
         )
         
+        try:
+            self.db.table("explanations").upsert({
+                "source_hash": source_hash,
+                "target_paper_id": target_paper_id,
+                "explanation": explanation_result["explanation"],
+                "metadata": explanation_result["metadata"]
+            }).execute()
+        except Exception as e:
+            logger.warning("Failed to cache explanation: %s", e)
+        
         return {
             "explanation": explanation_result["explanation"],
             "metadata": explanation_result["metadata"],
             "target_paper_id": target_paper_id
         }
     
-    def _store_chunks(self, paper_id: str, chunks: List[str]):
-        """Store text chunks in database."""
-        chunks_data = [
-            {
-                "paper_id": paper_id,
-                "chunk_index": i,
-                "text_content": chunk
-            }
-            for i, chunk in enumerate(chunks)
-        ]
-        
-        if chunks_data:
-            self.db.table("paper_chunks").insert(chunks_data).execute()
-    
-    def _store_paper(
+    def _store_paper_with_chunks(
         self,
         paper_id: str,
         title: str,
@@ -268,13 +538,13 @@ class ResearchAgent:
         source: str,
         source_id: Optional[str],
         schema: Dict[str, Any],
-        embedding: List[float]
+        embedding: List[float],
+        chunks: List[str]
     ):
-        """Store paper with schema and embedding in database."""
-        # Supabase pgvector expects the embedding as a list/array
-        # The Python client should handle the conversion automatically
-        # If issues occur, we may need to use raw SQL or format as PostgreSQL array string
-        
+        """
+        Store paper with schema, embedding and text chunks in one RPC call
+        (see migrations/004_upsert_paper_with_chunks.sql).
+        """
         paper_data = {
             "id": paper_id,
             "title": title,
@@ -282,16 +552,19 @@ class ResearchAgent:
             "source": source,
             "source_id": source_id,
             "structural_schema": schema,
-            "structural_embedding": embedding,  # Pass as list, Supabase should handle conversion
+            "structural_embedding": embedding,  # Unit-length list, cast to vector by PostgREST
             "processed_at": datetime.utcnow().isoformat()
         }
         
-        try:
-            self.db.table("papers").insert(paper_data).execute()
-        except Exception as e:
-            # If direct insertion fails, try with formatted string
-            # Some Supabase setups require explicit array formatting
-            print(f"[WARNING] Direct embedding insert failed, trying formatted string: {e}")
-            embedding_str = "[" + ",".join(map(str, embedding)) + "]"
-            paper_data["structural_embedding"] = embedding_str
-            self.db.table("papers").insert(paper_data).execute()
+        self.db.rpc("upsert_paper_with_chunks", {
+            "p": paper_data,
+            "c": chunks
+        }).execute()
+        
+        # Keep the in-memory fallback index in sync with the database
+        self.paper_index.add({
+            "id": paper_id,
+            "title": title,
+            "domain": domain,
+            "structural_schema": schema
+        }, embedding)
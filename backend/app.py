@@ -4,23 +4,76 @@ Provides REST endpoints for the React frontend.
 """
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import traceback
+from werkzeug.exceptions import RequestEntityTooLarge
+import atexit
+import io
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 
 from config import Config
+from database.db import get_client
 from agents.research_agent import ResearchAgent
 
-# Validate configuration on startup
-try:
-    Config.validate()
-except ValueError as e:
-    print(f"[WARNING] Configuration validation failed: {e}")
-    print("[INFO] Make sure to set up your .env file")
+def configure_logging():
+    """
+    Route all log records through a queue drained by a background thread,
+    so request threads never block on handler I/O.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("[%(levelname)s] %(name)s: %(message)s"))
+    listener = QueueListener(log_queue, handler)
+    
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(log_queue)]
+    root.setLevel(Config.LOG_LEVEL)
+    
+    listener.start()
+    atexit.register(listener.stop)
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
+# Werkzeug rejects larger bodies before spooling them; 1MB of slack for form fields
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_PDF_BYTES + 1024 * 1024
 
-# Initialize agent
-agent = ResearchAgent()
+# Upper bound on ?limit= for GET /api/papers
+MAX_PAGE_SIZE = 200
+
+_agent: Optional[ResearchAgent] = None
+_agent_lock = threading.Lock()
+
+def get_agent() -> ResearchAgent:
+    """Get the process-wide agent, created on first use."""
+    global _agent
+    with _agent_lock:
+        if _agent is None:
+            _agent = ResearchAgent()
+        return _agent
+
+def create_app() -> Flask:
+    """
+    Configure logging, validate configuration and build the agent.
+    
+    Importing this module has no side effects beyond defining the app, because
+    PDF extraction worker processes re-import the main module. Call this once
+    per server process (gunicorn: 'app:create_app()').
+    """
+    configure_logging()
+    
+    # Validate configuration on startup
+    try:
+        Config.validate()
+    except ValueError as e:
+        logger.warning("Configuration validation failed: %s", e)
+        logger.info("Make sure to set up your .env file")
+    
+    get_agent()
+    return app
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -34,9 +87,11 @@ def upload_paper():
     
     Accepts:
     - PDF file upload (multipart/form-data)
+    - Optional ?async=true query param to queue processing in the background
     
     Returns:
     - paper_id, title, schema, trace
+    - With async=true: 202 with paper_id; poll GET /api/papers/<paper_id>
     """
     try:
         if 'file' not in request.files:
@@ -49,15 +104,23 @@ def upload_paper():
         if not file.filename.lower().endswith('.pdf'):
             return jsonify({"error": "File must be a PDF"}), 400
         
-        pdf_bytes = file.read()
         title = request.form.get('title', '')
         
-        result = agent.process_paper(pdf_file=pdf_bytes, title=title)
+        if request.args.get('async', '').lower() == 'true':
+            # The upload stream is closed when the request ends, so the
+            # background job needs its own copy
+            pdf_file = io.BytesIO(file.read())
+            paper_id = get_agent().submit_paper(pdf_file=pdf_file, title=title)
+            return jsonify({"paper_id": paper_id, "status": "processing"}), 202
+        
+        # Parse straight from Werkzeug's spooled upload stream, no extra copy
+        result = get_agent().process_paper(pdf_file=file.stream, title=title)
         return jsonify(result), 201
             
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"File exceeds {Config.MAX_PDF_BYTES} bytes"}), 413
     except Exception as e:
-        print(f"[ERROR] Upload failed: {e}")
-        print(traceback.format_exc())
+        logger.exception("Upload failed: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/papers/<paper_id>/analogies', methods=['POST'])
@@ -76,15 +139,12 @@ def find_analogies(paper_id):
         List of matched papers with similarity scores
     """
     try:
-        # Get paper schema
-        from database.db import Database
-        db = Database.get_client()
-        response = db.table("papers").select("structural_schema, domain").eq("id", paper_id).execute()
+        # Get paper domain
+        response = get_client().table("papers").select("domain").eq("id", paper_id).execute()
         
         if not response.data:
             return jsonify({"error": f"Paper {paper_id} not found"}), 404
         
-        schema = response.data[0]["structural_schema"]
         domain = response.data[0].get("domain")
         
         # Get parameters
@@ -92,9 +152,9 @@ def find_analogies(paper_id):
         top_k = data.get("top_k", 5)
         exclude_domain = data.get("exclude_domain", domain)  # Exclude same domain by default
         
-        # Find analogies
-        matches = agent.find_analogous_papers(
-            query_schema=schema,
+        # Find analogies from the stored embedding (no re-embedding needed)
+        matches = get_agent().find_analogous_to_paper(
+            paper_id=paper_id,
             top_k=top_k,
             exclude_domain=exclude_domain
         )
@@ -105,8 +165,7 @@ def find_analogies(paper_id):
         }), 200
         
     except Exception as e:
-        print(f"[ERROR] Analogy search failed: {e}")
-        print(traceback.format_exc())
+        logger.exception("Analogy search failed: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/papers/<paper_id>/explain/<target_paper_id>', methods=['GET'])
@@ -123,9 +182,7 @@ def explain_analogy(paper_id, target_paper_id):
     """
     try:
         # Get source paper schema
-        from database.db import Database
-        db = Database.get_client()
-        response = db.table("papers").select("structural_schema").eq("id", paper_id).execute()
+        response = get_client().table("papers").select("structural_schema").eq("id", paper_id).execute()
         
         if not response.data:
             return jsonify({"error": f"Paper {paper_id} not found"}), 404
@@ -133,7 +190,7 @@ def explain_analogy(paper_id, target_paper_id):
         source_schema = response.data[0]["structural_schema"]
         
         # Generate explanation
-        result = agent.generate_explanation_for_match(
+        result = get_agent().generate_explanation_for_match(
             source_schema=source_schema,
             target_paper_id=target_paper_id
         )
@@ -141,8 +198,7 @@ def explain_analogy(paper_id, target_paper_id):
         return jsonify(result), 200
         
     except Exception as e:
-        print(f"[ERROR] Explanation generation failed: {e}")
-        print(traceback.format_exc())
+        logger.exception("Explanation generation failed: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/papers', methods=['GET'])
@@ -152,46 +208,54 @@ def list_papers():
     
     Query params:
         domain: Filter by domain
-        limit: Limit results (default: 50)
+        limit: Limit results (default: 50, max: 200)
+        offset: Number of papers to skip, for pagination (default: 0)
         
     Returns:
-        List of papers with basic info
+        List of papers with basic info, newest first
     """
     try:
-        from database.db import Database
-        db = Database.get_client()
-        
-        query = db.table("papers").select("id, title, domain, source, uploaded_at, structural_schema")
+        # Pull only the two schema fields shown in the list, not the whole JSON
+        query = get_client().table("papers").select(
+            "id, title, domain, source, uploaded_at, "
+            "system_name:structural_schema->>system_name, "
+            "optimization_goal:structural_schema->>optimization_goal"
+        )
         
         # Apply filters
         domain = request.args.get('domain')
         if domain:
             query = query.eq("domain", domain)
         
-        limit = int(request.args.get('limit', 50))
-        query = query.limit(limit)
+        try:
+            limit = int(request.args.get('limit', 50))
+            offset = int(request.args.get('offset', 0))
+        except ValueError:
+            return jsonify({"error": "limit and offset must be integers"}), 400
+        if limit < 1 or offset < 0:
+            return jsonify({"error": "limit must be >= 1 and offset >= 0"}), 400
+        limit = min(limit, MAX_PAGE_SIZE)
+        query = query.order("uploaded_at", desc=True).range(offset, offset + limit - 1)
         
         response = query.execute()
         
         # Format response
         papers = []
         for paper in response.data:
-            schema = paper.get("structural_schema", {})
             papers.append({
                 "id": paper["id"],
                 "title": paper.get("title"),
                 "domain": paper.get("domain"),
                 "source": paper.get("source"),
-                "system_name": schema.get("system_name"),
-                "optimization_goal": schema.get("optimization_goal", "")[:100],
+                "system_name": paper.get("system_name"),
+                "optimization_goal": (paper.get("optimization_goal") or "")[:100],
                 "uploaded_at": paper.get("uploaded_at")
             })
         
         return jsonify({"papers": papers}), 200
         
     except Exception as e:
-        print(f"[ERROR] List papers failed: {e}")
-        print(traceback.format_exc())
+        logger.exception("List papers failed: %s", e)
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/papers/<paper_id>', methods=['GET'])
@@ -201,26 +265,32 @@ def get_paper(paper_id):
     
     Returns:
         Complete paper data with schema
+        (202 with status "processing" while an async upload is still running)
     """
     try:
-        from database.db import Database
-        db = Database.get_client()
-        
-        response = db.table("papers").select("*").eq("id", paper_id).execute()
+        # Everything except structural_embedding, which the client never needs
+        response = get_client().table("papers").select(
+            "id, title, domain, source, source_id, structural_schema, processed_at, uploaded_at"
+        ).eq("id", paper_id).execute()
         
         if not response.data:
+            job = get_agent().get_job_status(paper_id)
+            if job and job["status"] == "processing":
+                return jsonify({"id": paper_id, **job}), 202
+            if job:
+                return jsonify({"id": paper_id, **job}), 500
             return jsonify({"error": f"Paper {paper_id} not found"}), 404
         
         paper = response.data[0]
         return jsonify(paper), 200
         
     except Exception as e:
-        print(f"[ERROR] Get paper failed: {e}")
-        print(traceback.format_exc())
+        logger.exception("Get paper failed: %s", e)
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    print("[INFO] Starting Research Discovery Engine API...")
-    print(f"[INFO] Environment: {Config.FLASK_ENV}")
-    print(f"[INFO] Debug: {Config.FLASK_DEBUG}")
+    create_app()
+    logger.info("Starting Research Discovery Engine API...")
+    logger.info("Environment: %s", Config.FLASK_ENV)
+    logger.info("Debug: %s", Config.FLASK_DEBUG)
     app.run(host='0.0.0.0', port=Config.PORT, debug=Config.FLASK_DEBUG)
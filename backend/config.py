@@ -21,14 +21,32 @@ class Config:
     
     # LLM Configuration
     LLM_MODEL = os.getenv('LLM_MODEL', 'claude-3-sonnet')
+    ABSTRACTION_INPUT_TOKENS = int(os.getenv('ABSTRACTION_INPUT_TOKENS', 6000))  # Paper text budget for Step B
+    KEYWORDS_STREAM = os.getenv('KEYWORDS_STREAM', 'False').lower() == 'true'  # Stream structural abstraction responses
+    # Gzip request bodies over 4KB; only enable if the gateway accepts Content-Encoding: gzip
+    KEYWORDS_GZIP_REQUESTS = os.getenv('KEYWORDS_GZIP_REQUESTS', 'False').lower() == 'true'
+    
+    # Exact-match cache for low-temperature gateway calls
+    KEYWORDS_CACHE_ENABLED = os.getenv('KEYWORDS_CACHE_ENABLED', 'True').lower() == 'true'
+    KEYWORDS_CACHE_SIZE = int(os.getenv('KEYWORDS_CACHE_SIZE', 1000))
+    KEYWORDS_CACHE_TTL = int(os.getenv('KEYWORDS_CACHE_TTL', 3600))  # Seconds
+    # Reuse explanations for near-identical schema pairs (costs one embedding call per miss)
+    EXPLANATION_SEMANTIC_CACHE = os.getenv('EXPLANATION_SEMANTIC_CACHE', 'False').lower() == 'true'
+    EXPLANATION_SEMANTIC_THRESHOLD = float(os.getenv('EXPLANATION_SEMANTIC_THRESHOLD', 0.95))
     
     # Application
     FLASK_ENV = os.getenv('FLASK_ENV', 'development')
     FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
     PORT = int(os.getenv('PORT', 5000))
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 4))  # Background upload processing threads
+    FAILED_JOB_TTL = int(os.getenv('FAILED_JOB_TTL', 3600))  # Seconds a failed async upload stays pollable
+    PDF_WORKERS = int(os.getenv('PDF_WORKERS', 4))  # Processes for page extraction of long PDFs
+    MAX_PDF_BYTES = int(os.getenv('MAX_PDF_BYTES', 50 * 1024 * 1024))  # Upload size limit
     
     # Vector Search
     EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-3-large')
+    EMBEDDING_DIM = int(os.getenv('EMBEDDING_DIM', 1024))  # Must match vector(D) in the papers table
     TOP_K_RESULTS = int(os.getenv('TOP_K_RESULTS', 5))
     
     @classmethod
@@ -0,0 +1,51 @@
+-- Migration: 002_hnsw_match_papers.sql
+-- Description: Replace the IVFFlat index with HNSW and add the match_papers RPC
+-- Created: 2024-01-XX
+--
+-- To apply: Run this in Supabase SQL Editor (after 001_initial_schema.sql)
+--
+-- The API previously fetched every paper and computed cosine similarity in
+-- Python. match_papers pushes the top-k search into Postgres so only k rows
+-- ever leave the database.
+
+-- HNSW does not need training data (unlike IVFFlat) and gives better recall
+-- at the same query cost, so it replaces the index from 001.
+DROP INDEX IF EXISTS papers_structural_embedding_idx;
+
+CREATE INDEX IF NOT EXISTS papers_embedding_hnsw
+ON papers
+USING hnsw (structural_embedding vector_cosine_ops)
+WITH (m = 24, ef_construction = 128);
+
+-- Top-k structural retrieval, optionally excluding one domain.
+-- Called from ResearchAgent.find_analogous_papers via db.rpc("match_papers", ...)
+CREATE OR REPLACE FUNCTION match_papers(
+    query_embedding vector,
+    k INTEGER,
+    exclude_domain TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    title TEXT,
+    domain TEXT,
+    structural_schema JSONB,
+    similarity DOUBLE PRECISION
+)
+LANGUAGE sql STABLE
+-- Equivalent to SET LOCAL for the duration of the call
+SET hnsw.ef_search = 100
+AS $$
+    SELECT
+        p.id,
+        p.title,
+        p.domain,
+        p.structural_schema,
+        1 - (p.structural_embedding <=> query_embedding) AS similarity
+    FROM papers p
+    WHERE p.structural_embedding IS NOT NULL
+      AND (exclude_domain IS NULL OR p.domain IS DISTINCT FROM exclude_domain)
+    ORDER BY p.structural_embedding <=> query_embedding
+    LIMIT k;
+$$;
+
+COMMENT ON FUNCTION match_papers IS 'Top-k cosine similarity search over papers.structural_embedding using the HNSW index';
@@ -0,0 +1,46 @@
+-- Migration: 003_match_papers_to_paper.sql
+-- Description: Add match_papers_to_paper RPC for analogy search from a stored paper
+-- Created: 2024-01-XX
+--
+-- To apply: Run this in Supabase SQL Editor (after 002_hnsw_match_papers.sql)
+--
+-- structural_embedding is already declared vector(1536) in 001, so embeddings
+-- are stored in pgvector's binary format. This function looks up the source
+-- paper's embedding server-side, so the analogies endpoint never has to fetch
+-- and JSON-decode a 1536-dim vector in Python.
+
+CREATE OR REPLACE FUNCTION match_papers_to_paper(
+    source_paper_id UUID,
+    k INTEGER,
+    exclude_domain TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    title TEXT,
+    domain TEXT,
+    structural_schema JSONB,
+    similarity DOUBLE PRECISION
+)
+LANGUAGE sql STABLE
+SET hnsw.ef_search = 100
+AS $$
+    WITH source AS (
+        SELECT structural_embedding AS embedding
+        FROM papers
+        WHERE papers.id = source_paper_id
+    )
+    SELECT
+        p.id,
+        p.title,
+        p.domain,
+        p.structural_schema,
+        1 - (p.structural_embedding <=> source.embedding) AS similarity
+    FROM papers p, source
+    WHERE p.structural_embedding IS NOT NULL
+      AND p.id <> source_paper_id
+      AND (exclude_domain IS NULL OR p.domain IS DISTINCT FROM exclude_domain)
+    ORDER BY p.structural_embedding <=> source.embedding
+    LIMIT k;
+$$;
+
+COMMENT ON FUNCTION match_papers_to_paper IS 'Top-k cosine similarity search using the stored embedding of an existing paper';
@@ -0,0 +1,50 @@
+-- Migration: 004_upsert_paper_with_chunks.sql
+-- Description: Store a paper and its text chunks in one transactional RPC
+-- Created: 2024-01-XX
+--
+-- To apply: Run this in Supabase SQL Editor (after 003_match_papers_to_paper.sql)
+--
+-- Uploads previously inserted the paper row and its chunks with two separate
+-- PostgREST requests. This function does both in a single round-trip, and
+-- either both inserts land or neither does.
+
+-- p: paper row as JSON (id, title, domain, source, source_id,
+--    structural_schema, structural_embedding, processed_at)
+-- c: JSON array of chunk texts, in order
+CREATE OR REPLACE FUNCTION upsert_paper_with_chunks(p JSONB, c JSONB)
+RETURNS UUID
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    new_id UUID;
+BEGIN
+    INSERT INTO papers (
+        id, title, domain, source, source_id,
+        structural_schema, structural_embedding, processed_at
+    )
+    SELECT
+        r.id, r.title, r.domain, COALESCE(r.source, 'upload'), r.source_id,
+        r.structural_schema, r.structural_embedding, r.processed_at
+    FROM jsonb_populate_record(NULL::papers, p) AS r
+    ON CONFLICT (id) DO UPDATE SET
+        title = EXCLUDED.title,
+        domain = EXCLUDED.domain,
+        source = EXCLUDED.source,
+        source_id = EXCLUDED.source_id,
+        structural_schema = EXCLUDED.structural_schema,
+        structural_embedding = EXCLUDED.structural_embedding,
+        processed_at = EXCLUDED.processed_at
+    RETURNING id INTO new_id;
+
+    -- Re-processing a paper replaces its chunks
+    DELETE FROM paper_chunks WHERE paper_id = new_id;
+
+    INSERT INTO paper_chunks (paper_id, chunk_index, text_content)
+    SELECT new_id, (chunk.ordinality - 1)::INTEGER, chunk.value
+    FROM jsonb_array_elements_text(COALESCE(c, '[]'::JSONB)) WITH ORDINALITY AS chunk(value, ordinality);
+
+    RETURN new_id;
+END;
+$$;
+
+COMMENT ON FUNCTION upsert_paper_with_chunks IS 'Atomically inserts (or replaces) a paper and its text chunks';
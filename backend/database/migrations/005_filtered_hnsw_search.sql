@@ -0,0 +1,83 @@
+-- Migration: 005_filtered_hnsw_search.sql
+-- Description: Keep recall high when match_papers* filters out a domain
+-- Created: 2024-01-XX
+--
+-- To apply: Run this in Supabase SQL Editor (after 004_upsert_paper_with_chunks.sql)
+-- Requires pgvector 0.8+ (for hnsw.iterative_scan)
+--
+-- The HNSW index returns ef_search candidates and the WHERE clause is applied
+-- afterwards. When most papers share the excluded domain, few candidates survive
+-- and fewer than k rows come back. Iterative scans keep walking the graph until
+-- enough rows pass the filter, and ordering stays exact (strict_order).
+
+CREATE OR REPLACE FUNCTION match_papers(
+    query_embedding vector,
+    k INTEGER,
+    exclude_domain TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    title TEXT,
+    domain TEXT,
+    structural_schema JSONB,
+    similarity DOUBLE PRECISION
+)
+LANGUAGE sql STABLE
+SET hnsw.ef_search = 100
+SET hnsw.iterative_scan = strict_order
+AS $$
+    SELECT
+        p.id,
+        p.title,
+        p.domain,
+        p.structural_schema,
+        1 - (p.structural_embedding <=> query_embedding) AS similarity
+    FROM papers p
+    WHERE p.structural_embedding IS NOT NULL
+      AND (exclude_domain IS NULL OR p.domain IS DISTINCT FROM exclude_domain)
+    ORDER BY p.structural_embedding <=> query_embedding
+    LIMIT k;
+$$;
+
+CREATE OR REPLACE FUNCTION match_papers_to_paper(
+    source_paper_id UUID,
+    k INTEGER,
+    exclude_domain TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    title TEXT,
+    domain TEXT,
+    structural_schema JSONB,
+    similarity DOUBLE PRECISION
+)
+LANGUAGE sql STABLE
+SET hnsw.ef_search = 100
+SET hnsw.iterative_scan = strict_order
+AS $$
+    WITH source AS (
+        SELECT structural_embedding AS embedding
+        FROM papers
+        WHERE papers.id = source_paper_id
+    )
+    SELECT
+        p.id,
+        p.title,
+        p.domain,
+        p.structural_schema,
+        1 - (p.structural_embedding <=> source.embedding) AS similarity
+    FROM papers p, source
+    WHERE p.structural_embedding IS NOT NULL
+      AND p.id <> source_paper_id
+      AND (exclude_domain IS NULL OR p.domain IS DISTINCT FROM exclude_domain)
+    ORDER BY p.structural_embedding <=> source.embedding
+    LIMIT k;
+$$;
+
+-- If one domain dominates the corpus and is excluded on most queries, a partial
+-- index lets the planner skip it entirely, e.g.:
+--
+-- CREATE INDEX papers_embedding_hnsw_not_biology
+-- ON papers USING hnsw (structural_embedding vector_cosine_ops)
+-- WITH (m = 24, ef_construction = 128)
+-- WHERE domain <> 'biology';
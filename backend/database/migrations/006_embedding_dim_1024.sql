@@ -0,0 +1,28 @@
+-- Migration: 006_embedding_dim_1024.sql
+-- Description: Shrink structural_embedding to 1024 dimensions
+-- Created: 2024-01-XX
+--
+-- To apply: Run this in Supabase SQL Editor (after 005_filtered_hnsw_search.sql)
+--
+-- EmbeddingService now requests 1024-d vectors from text-embedding-3 via the
+-- `dimensions` parameter (Config.EMBEDDING_DIM). Shorter vectors cut memory and
+-- bandwidth per distance computation ~3x versus 3072-d and make the HNSW graph
+-- cheaper to build, so the index uses pgvector's default build parameters.
+--
+-- Existing embeddings have the old dimension and are cleared. Regenerate them with:
+--   cd backend && python -c "from agents.research_agent import ResearchAgent; ResearchAgent().backfill_embeddings()"
+--
+-- If you change EMBEDDING_DIM, write a new migration with the matching vector(D).
+
+DROP INDEX IF EXISTS papers_embedding_hnsw;
+
+UPDATE papers SET structural_embedding = NULL;
+
+ALTER TABLE papers ALTER COLUMN structural_embedding TYPE vector(1024);
+
+CREATE INDEX IF NOT EXISTS papers_embedding_hnsw
+ON papers
+USING hnsw (structural_embedding vector_cosine_ops)
+WITH (m = 16, ef_construction = 64);
+
+COMMENT ON COLUMN papers.structural_embedding IS 'Unit-length 1024-d embedding computed from optimization_goal, constraints, state_variables, and failure_modes fields';
@@ -0,0 +1,59 @@
+-- Migration: 007_halfvec_embeddings.sql
+-- Description: Store structural_embedding as halfvec (FP16)
+-- Created: 2024-01-XX
+--
+-- To apply: Run this in Supabase SQL Editor (after 006_embedding_dim_1024.sql)
+-- Requires pgvector 0.7+ (for halfvec)
+--
+-- Half-precision storage halves the on-disk size of every embedding and the
+-- bytes read per distance computation, with no measurable recall loss for
+-- text embeddings. The API still sends and receives plain float lists.
+
+DROP INDEX IF EXISTS papers_embedding_hnsw;
+
+ALTER TABLE papers
+ALTER COLUMN structural_embedding TYPE halfvec(1024)
+USING structural_embedding::halfvec(1024);
+
+CREATE INDEX IF NOT EXISTS papers_embedding_hnsw
+ON papers
+USING hnsw (structural_embedding halfvec_cosine_ops)
+WITH (m = 16, ef_construction = 64);
+
+-- The query parameter must be halfvec too so <=> can use the index.
+-- Changing a parameter type creates a new overload, so drop the old one first.
+DROP FUNCTION IF EXISTS match_papers(vector, INTEGER, TEXT);
+
+CREATE OR REPLACE FUNCTION match_papers(
+    query_embedding halfvec,
+    k INTEGER,
+    exclude_domain TEXT DEFAULT NULL
+)
+RETURNS TABLE (
+    id UUID,
+    title TEXT,
+    domain TEXT,
+    structural_schema JSONB,
+    similarity DOUBLE PRECISION
+)
+LANGUAGE sql STABLE
+SET hnsw.ef_search = 100
+SET hnsw.iterative_scan = strict_order
+AS $$
+    SELECT
+        p.id,
+        p.title,
+        p.domain,
+        p.structural_schema,
+        1 - (p.structural_embedding <=> query_embedding) AS similarity
+    FROM papers p
+    WHERE p.structural_embedding IS NOT NULL
+      AND (exclude_domain IS NULL OR p.domain IS DISTINCT FROM exclude_domain)
+    ORDER BY p.structural_embedding <=> query_embedding
+    LIMIT k;
+$$;
+
+COMMENT ON FUNCTION match_papers IS 'Top-k cosine similarity search over papers.structural_embedding using the HNSW index';
+
+-- match_papers_to_paper and upsert_paper_with_chunks read the column type at
+-- call time and need no changes.
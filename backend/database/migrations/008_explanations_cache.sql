@@ -0,0 +1,27 @@
+-- Migration: 008_explanations_cache.sql
+-- Description: Persistent cache of generated analogy explanations
+-- Created: 2024-01-XX
+--
+-- To apply: Run this in Supabase SQL Editor (after 007_halfvec_embeddings.sql)
+--
+-- Explanations for the same (source schema, target paper) pair are stable, so
+-- ResearchAgent.generate_explanation_for_match stores each one here and skips
+-- the LLM call on later requests.
+
+CREATE TABLE IF NOT EXISTS explanations (
+    -- SHA-256 of the canonical (sorted-key) JSON of the source schema
+    source_hash TEXT NOT NULL,
+    target_paper_id UUID NOT NULL,
+    explanation TEXT NOT NULL,
+    metadata JSONB,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+
+    PRIMARY KEY (source_hash, target_paper_id),
+
+    CONSTRAINT fk_explanations_target_paper_id
+        FOREIGN KEY (target_paper_id)
+        REFERENCES papers(id)
+        ON DELETE CASCADE
+);
+
+COMMENT ON TABLE explanations IS 'Cached LLM explanations keyed on (source schema hash, target paper)';
@@ -2,22 +2,54 @@
 Embedding service for generating vector embeddings of structural schemas.
 Uses OpenAI embeddings (can be routed through Keywords Gateway if needed).
 """
-import json
+import logging
+import httpx
+from functools import lru_cache
+import numpy as np
 from typing import List, Dict, Any
 from openai import OpenAI
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+def _normalize(embedding: List[float]) -> List[float]:
+    """L2-normalize an embedding so cosine similarity reduces to a dot product."""
+    vec = np.asarray(embedding, dtype=np.float32)
+    # vdot skips the dispatch/validation overhead of np.linalg.norm
+    vec /= np.sqrt(np.vdot(vec, vec)) + 1e-12
+    return vec.tolist()
+
+# Process-wide connection pool so TLS sessions to the embeddings endpoint
+# are reused across requests and EmbeddingService instances
+_http_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=32)
+)
+
+@lru_cache(maxsize=1)
+def _get_client() -> OpenAI:
+    """
+    Get the process-wide OpenAI client, routed through Keywords Gateway using
+    its API key and base URL. Built on first use so a missing key does not
+    break imports.
+    """
+    return OpenAI(
+        api_key=Config.KEYWORDS_API_KEY,
+        base_url=Config.KEYWORDS_API_URL,
+        http_client=_http_client
+    )
+
 class EmbeddingService:
     """Service for generating embeddings from structural schemas."""
     
     def __init__(self):
-        # Initialize OpenAI client for embeddings
-        # Route through Keywords Gateway using its API key and base URL
-        self.client = OpenAI(
-            api_key=Config.KEYWORDS_API_KEY,
-            base_url=Config.KEYWORDS_API_URL
-        )
         self.model = Config.EMBEDDING_MODEL
+        self.dim = Config.EMBEDDING_DIM
+    
+    @property
+    def client(self) -> OpenAI:
+        """Shared OpenAI client (see _get_client)."""
+        return _get_client()
     
     def embed_schema(self, schema: Dict[str, Any]) -> List[float]:
         """
@@ -33,32 +65,48 @@ class EmbeddingService:
             schema: Structural schema dictionary
             
         Returns:
-            List of floats representing the embedding vector
+            Unit-length list of floats representing the embedding vector
+        """
+        return self.embed_schemas([schema])[0]
+    
+    def embed_schemas(self, schemas: List[Dict[str, Any]]) -> List[List[float]]:
+        """
+        Generate embeddings for several structural schemas in one API call.
+        
+        Args:
+            schemas: List of structural schema dictionaries
+            
+        Returns:
+            List of unit-length embedding vectors, in the same order as schemas
         """
-        # Extract key fields for similarity search
-        key_fields = {
-            "optimization_goal": schema.get("optimization_goal", ""),
-            "constraints": ", ".join(schema.get("constraints", [])),
-            "state_variables": ", ".join(schema.get("state_variables", [])),
-            "failure_modes": ", ".join(schema.get("failure_modes", []))
-        }
+        if not schemas:
+            return []
         
-        # Create text representation for embedding
-        embedding_text = f"""Optimization Goal: {key_fields['optimization_goal']}
-Constraints: {key_fields['constraints']}
-State Variables: {key_fields['state_variables']}
-Failure Modes: {key_fields['failure_modes']}"""
+        texts = [self._schema_to_text(schema) for schema in schemas]
         
-        # Generate embedding
+        # Generate all embeddings in a single round-trip
         try:
             response = self.client.embeddings.create(
                 model=self.model,
-                input=embedding_text
+                input=texts,
+                dimensions=self.dim
             )
-            return response.data[0].embedding
         except Exception as e:
-            print(f"[ERROR] Embedding generation failed: {e}")
+            logger.error("Embedding generation failed: %s", e)
             raise
+        
+        data = sorted(response.data, key=lambda d: d.index)
+        return [_normalize(d.embedding) for d in data]
+    
+    def _schema_to_text(self, schema: Dict[str, Any]) -> str:
+        """Build the text representation of a schema used for embedding."""
+        # Only the key fields used for similarity search, formatted in one pass
+        return (
+            f"Optimization Goal: {schema.get('optimization_goal', '')}\n"
+            f"Constraints: {', '.join(schema.get('constraints', ()))}\n"
+            f"State Variables: {', '.join(schema.get('state_variables', ()))}\n"
+            f"Failure Modes: {', '.join(schema.get('failure_modes', ()))}"
+        )
     
     def embed_text(self, text: str) -> List[float]:
         """
@@ -68,14 +116,15 @@ Failure Modes: {key_fields['failure_modes']}"""
             text: Text to embed
             
         Returns:
-            List of floats representing the embedding vector
+            Unit-length list of floats representing the embedding vector
         """
         try:
             response = self.client.embeddings.create(
                 model=self.model,
-                input=text
+                input=text,
+                dimensions=self.dim
             )
-            return response.data[0].embedding
+            return _normalize(response.data[0].embedding)
         except Exception as e:
-            print(f"[ERROR] Embedding generation failed: {e}")
+            logger.error("Embedding generation failed: %s", e)
             raise
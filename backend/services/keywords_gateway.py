@@ -3,12 +3,285 @@ Keywords AI Gateway integration for observability and LLM routing.
 This service handles all LLM calls through the Keywords AI Gateway,
 logging each step with full observability.
 """
+import asyncio
+import atexit
+import gzip
+import logging
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
+import re
+import orjson
 import time
-from typing import Dict, Any, Optional
+import hashlib
+import threading
+import numpy as np
+import tiktoken
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Any, Final, List, Optional, Tuple
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+# System prompts are fixed module-level strings so every call sends identical
+# leading bytes, which lets the provider's prompt-prefix cache apply
+_STRUCTURAL_SYSTEM_PROMPT: Final[str] = """You are an expert at analyzing academic papers and extracting their structural components while stripping away field-specific jargon.
+
+Your task is to analyze a paper and extract its core structural elements into a fixed schema. Focus on the SYSTEM STRUCTURE, not the domain-specific details.
+
+Output ONLY valid JSON matching this exact schema:
+{
+  "system_name": "string - a brief name for the system",
+  "domain": "string - the academic field (e.g., 'biology', 'physics', 'economics')",
+  "entities": ["string"] - key components or actors in the system,
+  "state_variables": ["string"] - variables that describe the system state,
+  "optimization_goal": "string - what the system optimizes for",
+  "constraints": ["string"] - limitations or constraints on the system,
+  "failure_modes": ["string"] - ways the system can fail or break down,
+  "key_equations_or_principles": ["string"] - core mathematical or conceptual principles,
+  "plain_language_summary": "string - 2-3 sentence summary in plain language"
+}
+
+CRITICAL: 
+- Strip all field-specific jargon
+- Focus on structural patterns, not domain details
+- Output ONLY the JSON object, no markdown, no explanations
+- Ensure all fields are populated (use empty arrays/strings if needed)
+- The schema must be valid JSON that can be parsed directly"""
+
+# Static instructions lead the user prompt so its prefix is byte-identical across papers
+_STRUCTURAL_USER_PREFIX: Final[str] = """Analyze the following academic paper and extract its structural schema.
+Extract the structural schema following the format specified. Focus on the SYSTEM STRUCTURE, not domain-specific terminology.
+
+Title: """
+
+_STRUCTURAL_USER_MIDDLE: Final[str] = "\n\nPaper Text:\n"
+
+_EXPLANATION_SYSTEM_PROMPT: Final[str] = """You are an expert at identifying structural analogies between systems from different academic domains.
+
+Your task is to explain why two systems might be structurally analogous despite being from different fields. Focus on:
+- Similar optimization goals
+- Similar constraints
+- Similar state variables
+- Similar failure modes
+- Structural patterns, not domain-specific details
+
+Write a clear, concise explanation (2-3 paragraphs) that a researcher could use to understand the cross-disciplinary connection."""
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> Optional["tiktoken.Encoding"]:
+    """
+    Tokenizer for LLM_MODEL, loaded once. Models tiktoken does not know
+    (e.g. Claude) use cl100k_base as an approximation; None if no encoding
+    can be loaded (tiktoken fetches BPE files on first use).
+    """
+    try:
+        return tiktoken.encoding_for_model(Config.LLM_MODEL)
+    except KeyError:
+        pass
+    except Exception as e:
+        logger.warning("Could not load tokenizer for %s: %s", Config.LLM_MODEL, e)
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("Could not load cl100k_base tokenizer: %s", e)
+        return None
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens tokens (4 characters per token if no tokenizer)."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    # Tokens are rarely longer than 10 characters, so don't encode the whole paper
+    tokens = encoding.encode(text[:max_tokens * 10], disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text[:max_tokens * 10]
+    return encoding.decode(tokens[:max_tokens])
+
+# Required structural schema fields and their empty values. List fields are
+# immutable tuples here and become a fresh list per schema in _parse_schema.
+_SCHEMA_DEFAULTS: Final[Dict[str, Any]] = {
+    "system_name": "",
+    "domain": "",
+    "entities": (),
+    "state_variables": (),
+    "optimization_goal": "",
+    "constraints": (),
+    "failure_modes": (),
+    "key_equations_or_principles": (),
+    "plain_language_summary": ""
+}
+
+_EXPLANATION_USER_TEMPLATE: Final[str] = """Explain why these two systems might be structurally analogous:
+
+SOURCE SYSTEM ({src[domain]}):
+- System: {src[system_name]}
+- Optimization Goal: {src[optimization_goal]}
+- Constraints: {src[constraints]}
+- State Variables: {src[state_variables]}
+- Failure Modes: {src[failure_modes]}
+
+TARGET SYSTEM ({tgt[domain]}):
+- System: {tgt[system_name]}
+- Optimization Goal: {tgt[optimization_goal]}
+- Constraints: {tgt[constraints]}
+- State Variables: {tgt[state_variables]}
+- Failure Modes: {tgt[failure_modes]}
+
+Generate an explanation of the structural analogy."""
+
+def _prompt_fields(schema: Dict[str, Any]) -> Dict[str, str]:
+    """Format the schema fields used by _EXPLANATION_USER_TEMPLATE, joining each list once."""
+    return {
+        "domain": schema.get("domain", "unknown"),
+        "system_name": schema.get("system_name", "unknown"),
+        "optimization_goal": schema.get("optimization_goal", "N/A"),
+        "constraints": ", ".join(schema.get("constraints", ())),
+        "state_variables": ", ".join(schema.get("state_variables", ())),
+        "failure_modes": ", ".join(schema.get("failure_modes", ()))
+    }
+
+# Schema fields that feed the explanation prompt; only these affect the cache key
+_EXPLANATION_CACHE_FIELDS = (
+    "domain", "system_name", "optimization_goal",
+    "constraints", "state_variables", "failure_modes"
+)
+
+def _schema_fingerprint(schema: Dict[str, Any]) -> bytes:
+    """
+    Canonical bytes for the prompt-relevant part of a schema.
+    Strings are lowercased and stripped, and list fields sorted, so schemas that
+    only differ in whitespace, case or ordering share a cache entry.
+    """
+    normalized = {}
+    for field in _EXPLANATION_CACHE_FIELDS:
+        value = schema.get(field)
+        if isinstance(value, list):
+            value = sorted(str(item).strip().lower() for item in value)
+        elif isinstance(value, str):
+            value = value.strip().lower()
+        normalized[field] = value
+    return orjson.dumps(normalized, option=orjson.OPT_SORT_KEYS)
+
+# A markdown-fenced response; the closing fence is optional in case output was cut off
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*(?:```)?\s*$', re.DOTALL)
+
+# Request bodies smaller than this are not worth the compression CPU
+_GZIP_MIN_BYTES = 4096
+
+def _encode_body(payload: Dict[str, Any]) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Serialize a request payload, gzipping large bodies when KEYWORDS_GZIP_REQUESTS
+    is set. Responses are already negotiated compressed: requests and httpx both
+    send Accept-Encoding: gzip by default.
+    
+    Returns:
+        (body, extra headers)
+    """
+    body = orjson.dumps(payload)
+    if Config.KEYWORDS_GZIP_REQUESTS and len(body) > _GZIP_MIN_BYTES:
+        # Level 5 gives up a little ratio for much less CPU than the default 9
+        return gzip.compress(body, compresslevel=5), {"Content-Encoding": "gzip"}
+    return body, {}
+
+def _require_json_start(on_token: Optional[Callable[[str], None]]) -> Callable[[str], None]:
+    """
+    Wrap an on_token callback so a streamed schema response is aborted as soon
+    as its first non-whitespace character shows it cannot be a JSON object
+    (optionally inside a markdown fence), instead of after full generation.
+    """
+    started = False
+    
+    def check(delta: str):
+        nonlocal started
+        if not started:
+            head = delta.lstrip()
+            if head:
+                started = True
+                if head[0] not in "{`":
+                    raise ValueError(f"Invalid JSON schema returned: response starts with {head[:40]!r}")
+        if on_token:
+            on_token(delta)
+    
+    return check
+
+class _TTLCache:
+    """Thread-safe LRU cache whose entries expire after ttl seconds."""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+class _SemanticCache:
+    """
+    Nearest-neighbour cache over unit-length embeddings.
+    Returns a stored value when cosine similarity to the query is >= threshold.
+    
+    Vectors live in a preallocated (maxsize, dim) float32 ring buffer, so a
+    lookup is one matrix-vector product with no per-call copying.
+    """
+    
+    def __init__(self, maxsize: int, threshold: float, ttl: float):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl = ttl
+        self._matrix: Optional[np.ndarray] = None  # Allocated on first set, once dim is known
+        self._values: List[Any] = [None] * maxsize
+        self._expires_at = np.zeros(maxsize)
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+    
+    def get(self, embedding: List[float]) -> Optional[Any]:
+        with self._lock:
+            if not self._size:
+                return None
+            sims = self._matrix[:self._size] @ np.asarray(embedding, dtype=np.float32)
+            sims[self._expires_at[:self._size] < time.monotonic()] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] >= self.threshold:
+                return self._values[best]
+            return None
+    
+    def set(self, embedding: List[float], value: Any):
+        with self._lock:
+            vec = np.asarray(embedding, dtype=np.float32)
+            if self._matrix is None:
+                self._matrix = np.zeros((self.maxsize, vec.shape[0]), dtype=np.float32)
+            
+            # Overwrite the oldest slot once the buffer is full
+            slot = self._next
+            self._matrix[slot] = vec
+            self._values[slot] = value
+            self._expires_at[slot] = time.monotonic() + self.ttl
+            self._next = (slot + 1) % self.maxsize
+            self._size = min(self._size + 1, self.maxsize)
+
 class KeywordsGateway:
     """
     Client for Keywords AI Gateway.
@@ -19,6 +292,43 @@ class KeywordsGateway:
         self.api_key = Config.KEYWORDS_API_KEY
         self.base_url = Config.KEYWORDS_API_URL
         self.model = Config.LLM_MODEL
+        
+        # One keep-alive session per gateway so consecutive pipeline steps
+        # reuse the TCP/TLS connection instead of re-handshaking
+        self._session = requests.Session()
+        self._session.mount("https://", HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(
+                total=2,
+                read=0,  # A read timeout may mean the call is still generating; don't bill it twice
+                backoff_factor=0.2,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=None,  # Retry POSTs too
+                raise_on_status=False  # Hand the final error response to _make_request
+            )
+        ))
+        self._session.headers.update({
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        })
+        
+        # Exact-match cache for low-temperature (effectively deterministic) calls
+        self._cache = _TTLCache(maxsize=Config.KEYWORDS_CACHE_SIZE, ttl=Config.KEYWORDS_CACHE_TTL)
+        
+        # Explanation caches: exact match on normalized schema fingerprints (L1),
+        # then embedding similarity for near-identical schema pairs (L2)
+        self._explanation_cache = _TTLCache(maxsize=Config.KEYWORDS_CACHE_SIZE, ttl=Config.KEYWORDS_CACHE_TTL)
+        self._semantic_cache = _SemanticCache(
+            maxsize=Config.KEYWORDS_CACHE_SIZE,
+            threshold=Config.EXPLANATION_SEMANTIC_THRESHOLD,
+            ttl=Config.KEYWORDS_CACHE_TTL
+        )
+        self._embedding_service = None
+    
+    def close(self):
+        """Close the underlying HTTP session."""
+        self._session.close()
     
     def _make_request(
         self,
@@ -26,24 +336,246 @@ class KeywordsGateway:
         prompt: str,
         system_prompt: Optional[str] = None,
         temperature: float = 0.3,
-        max_tokens: int = 2000
+        max_tokens: int = 2000,
+        bypass_cache: bool = False,
+        stream: bool = False,
+        on_token: Optional[Callable[[str], None]] = None,
+        validate: Optional[Callable[[Dict[str, Any]], Any]] = None
     ) -> Dict[str, Any]:
         """
         Make an LLM request through Keywords AI Gateway.
         
+        Calls with temperature <= 0.3 are served from an exact-match cache
+        when KEYWORDS_CACHE_ENABLED is set.
+        
         Args:
             step_name: Name of the agent step (for observability)
             prompt: User prompt
             system_prompt: Optional system prompt
             temperature: Sampling temperature
             max_tokens: Maximum tokens to generate
+            bypass_cache: Skip the cache lookup and refresh the stored response
+            stream: Receive the completion as server-sent events
+            on_token: Optional callback for each streamed content delta
+                (called once with the full content on a cache hit)
+            validate: Optional check run on a fresh response before it is
+                cached; if it raises, the response is not cached
+            
+        Returns:
+            Dictionary with 'content' (response text) and 'metadata' (latency, etc.)
+        """
+        start_time = time.time()
+        
+        cache_key = self._cache_key(prompt, system_prompt, temperature, max_tokens)
+        if cache_key is not None and not bypass_cache:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                if on_token:
+                    on_token(cached["content"])
+                return self._cached_response(cached, step_name, start_time)
+        
+        payload = self._build_payload(prompt, system_prompt, temperature, max_tokens)
+        if stream:
+            payload["stream"] = True
+        metadata = self._build_metadata(step_name, prompt, system_prompt)
+        
+        try:
+            # Make request to Keywords Gateway (auth headers are set on the session)
+            endpoint = f"{self.base_url}/chat/completions"
+            
+            # Serialize with orjson rather than requests' stdlib-based json=
+            body, headers = _encode_body(payload)
+            response = self._session.post(
+                endpoint,
+                data=body,
+                headers=headers,
+                timeout=120,
+                stream=stream
+            )
+            
+            streamed = False
+            if stream:
+                with response:
+                    # Only read the body up front on errors; on 200 it is the live stream
+                    if response.status_code != 200:
+                        self._check_status(response.status_code, response.text)
+                    content_type = response.headers.get("Content-Type", "")
+                    if content_type.startswith("text/event-stream"):
+                        content, result = self._read_stream(response, on_token)
+                        streamed = True
+                    else:
+                        # The gateway ignored "stream": true; load the plain JSON body
+                        response.content
+        except requests.exceptions.RequestException as e:
+            latency = time.time() - start_time
+            metadata.update({
+                "latency": latency,
+                "status": "error",
+                "error": str(e)
+            })
+            logger.error("Keywords Gateway request failed: %s", e)
+            raise
+        
+        if streamed:
+            response_data = self._build_result(content, result, metadata, start_time)
+        else:
+            response_data = self._parse_response(
+                response.status_code, response.content, response.text, metadata, start_time
+            )
+            if stream and on_token:
+                on_token(response_data["content"])
+        if validate:
+            validate(response_data)
+        if cache_key is not None:
+            self._cache.set(cache_key, response_data)
+        return response_data
+    
+    def _read_stream(
+        self,
+        response: requests.Response,
+        on_token: Optional[Callable[[str], None]]
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Accumulate an SSE chat completion stream.
+        
+        Returns:
+            (full content, last event payload)
+        """
+        # bytearray appends are amortized O(1), unlike repeated str concatenation
+        buffer = bytearray()
+        last_event: Dict[str, Any] = {}
+        
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                break
+            
+            event = orjson.loads(data)
+            last_event = event
+            choices = event.get("choices") or []
+            delta = (choices[0].get("delta") or {}).get("content") if choices else None
+            if delta:
+                buffer += delta.encode("utf-8")
+                if on_token:
+                    on_token(delta)
+        
+        return buffer.decode("utf-8"), last_event
+    
+    async def _make_request_async(
+        self,
+        client: httpx.AsyncClient,
+        step_name: str,
+        prompt: str,
+        system_prompt: Optional[str] = None,
+        temperature: float = 0.3,
+        max_tokens: int = 2000,
+        bypass_cache: bool = False,
+        validate: Optional[Callable[[Dict[str, Any]], Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Async variant of _make_request for concurrent batch pipelines.
+        
+        Args:
+            client: AsyncClient from _async_client() (shared across the batch)
+            (remaining arguments as in _make_request)
             
         Returns:
             Dictionary with 'content' (response text) and 'metadata' (latency, etc.)
         """
         start_time = time.time()
         
-        # Construct request payload
+        cache_key = self._cache_key(prompt, system_prompt, temperature, max_tokens)
+        if cache_key is not None and not bypass_cache:
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return self._cached_response(cached, step_name, start_time)
+        
+        payload = self._build_payload(prompt, system_prompt, temperature, max_tokens)
+        metadata = self._build_metadata(step_name, prompt, system_prompt)
+        
+        try:
+            body, headers = _encode_body(payload)
+            response = await client.post(
+                f"{self.base_url}/chat/completions",
+                content=body,
+                headers=headers
+            )
+        except httpx.HTTPError as e:
+            latency = time.time() - start_time
+            metadata.update({
+                "latency": latency,
+                "status": "error",
+                "error": str(e)
+            })
+            logger.error("Keywords Gateway request failed: %s", e)
+            raise
+        
+        response_data = self._parse_response(
+            response.status_code, response.content, response.text, metadata, start_time
+        )
+        if validate:
+            validate(response_data)
+        if cache_key is not None:
+            self._cache.set(cache_key, response_data)
+        return response_data
+    
+    def _async_client(self) -> httpx.AsyncClient:
+        """
+        Create a pooled HTTP/2 client for one batch.
+        AsyncClient connections are bound to the event loop that opened them,
+        so each asyncio.run() gets its own client.
+        """
+        return httpx.AsyncClient(
+            http2=True,
+            timeout=120,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            }
+        )
+    
+    def _cache_key(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        temperature: float,
+        max_tokens: int
+    ) -> Optional[str]:
+        """Cache key for a request, or None if the call should not be cached."""
+        if not Config.KEYWORDS_CACHE_ENABLED or temperature > 0.3:
+            return None
+        return hashlib.sha256(orjson.dumps(
+            [self.model, system_prompt, prompt, temperature, max_tokens]
+        )).hexdigest()
+    
+    def _cached_response(
+        self,
+        cached: Dict[str, Any],
+        step_name: str,
+        start_time: float
+    ) -> Dict[str, Any]:
+        """Return a cached response with per-call metadata."""
+        return {
+            **cached,
+            "metadata": {
+                **cached["metadata"],
+                "step_name": step_name,
+                "latency": time.time() - start_time,
+                "cached": True
+            }
+        }
+    
+    def _build_payload(
+        self,
+        prompt: str,
+        system_prompt: Optional[str],
+        temperature: float,
+        max_tokens: int
+    ) -> Dict[str, Any]:
+        """Construct the chat completions request payload."""
         # Adjust this structure based on actual Keywords Gateway API format
         payload = {
             "model": self.model,
@@ -63,78 +595,84 @@ class KeywordsGateway:
         
         payload["temperature"] = temperature
         payload["max_tokens"] = max_tokens
-        
-        # Metadata for observability
-        metadata = {
+        return payload
+    
+    def _build_metadata(
+        self,
+        step_name: str,
+        prompt: str,
+        system_prompt: Optional[str]
+    ) -> Dict[str, Any]:
+        """Metadata for observability."""
+        return {
             "step_name": step_name,
             "model": self.model,
             "prompt_length": len(prompt),
             "system_prompt_length": len(system_prompt) if system_prompt else 0
         }
+    
+    def _parse_response(
+        self,
+        status_code: int,
+        body: bytes,
+        text: str,
+        metadata: Dict[str, Any],
+        start_time: float
+    ) -> Dict[str, Any]:
+        """Turn a raw gateway response into the {content, metadata, raw_response} result."""
+        self._check_status(status_code, text)
         
-        try:
-            # Make request to Keywords Gateway
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            # Try different possible endpoint formats
-            endpoint = f"{self.base_url}/chat/completions"
-            
-            response = requests.post(
-                endpoint,
-                headers=headers,
-                json=payload,
-                timeout=120
-            )
-            
-            latency = time.time() - start_time
-            
-            if response.status_code != 200:
-                # Log error but don't fail silently
-                error_msg = f"Keywords Gateway error: {response.status_code} - {response.text}"
-                print(f"[ERROR] {error_msg}")
-                raise Exception(error_msg)
-            
-            result = response.json()
-            
-            # Extract content from response
-            # Adjust based on actual Keywords Gateway response format
-            if "choices" in result and len(result["choices"]) > 0:
-                content = result["choices"][0]["message"]["content"]
-            elif "content" in result:
-                content = result["content"]
-            else:
-                content = str(result)
-            
-            metadata.update({
-                "latency": latency,
-                "status": "success",
-                "response_length": len(content),
-                "prompt_version_id": result.get("prompt_version_id", "unknown")
-            })
-            
-            return {
-                "content": content,
-                "metadata": metadata,
-                "raw_response": result
-            }
-            
-        except requests.exceptions.RequestException as e:
-            latency = time.time() - start_time
-            metadata.update({
-                "latency": latency,
-                "status": "error",
-                "error": str(e)
-            })
-            print(f"[ERROR] Keywords Gateway request failed: {e}")
-            raise
+        result = orjson.loads(body)
+        
+        # Extract content from response
+        # Adjust based on actual Keywords Gateway response format
+        if "choices" in result and len(result["choices"]) > 0:
+            content = result["choices"][0]["message"]["content"]
+        elif "content" in result:
+            content = result["content"]
+        else:
+            content = str(result)
+        
+        return self._build_result(content, result, metadata, start_time)
+    
+    def _check_status(self, status_code: int, text: str):
+        """Raise if the gateway did not return 200."""
+        if status_code != 200:
+            # Log error but don't fail silently
+            error_msg = f"Keywords Gateway error: {status_code} - {text}"
+            logger.error(error_msg)
+            raise Exception(error_msg)
+    
+    def _build_result(
+        self,
+        content: str,
+        result: Dict[str, Any],
+        metadata: Dict[str, Any],
+        start_time: float
+    ) -> Dict[str, Any]:
+        """Assemble the {content, metadata, raw_response} result of a successful call."""
+        metadata.update({
+            "latency": time.time() - start_time,
+            "status": "success",
+            "response_length": len(content),
+            # Counted by the provider, so no local tokenization pass is needed
+            # (None for streams, which carry no usage block)
+            "prompt_tokens": (result.get("usage") or {}).get("prompt_tokens"),
+            "prompt_version_id": result.get("prompt_version_id", "unknown")
+        })
+        
+        return {
+            "content": content,
+            "metadata": metadata,
+            "raw_response": result
+        }
     
     def structural_abstraction(
         self,
         paper_text: str,
-        paper_title: str = ""
+        paper_title: str = "",
+        bypass_cache: bool = False,
+        on_token: Optional[Callable[[str], None]] = None
     ) -> Dict[str, Any]:
         """
         Step B: Structural Abstraction
@@ -143,79 +681,108 @@ class KeywordsGateway:
         Args:
             paper_text: Raw text from PDF
             paper_title: Optional paper title for context
+            bypass_cache: Force a fresh LLM call instead of a cached response
+            on_token: Optional callback receiving streamed output (for progress display)
             
         Returns:
             Dictionary with 'schema' (JSON) and 'metadata'
         """
-        system_prompt = """You are an expert at analyzing academic papers and extracting their structural components while stripping away field-specific jargon.
-
-Your task is to analyze a paper and extract its core structural elements into a fixed schema. Focus on the SYSTEM STRUCTURE, not the domain-specific details.
-
-Output ONLY valid JSON matching this exact schema:
-{
-  "system_name": "string - a brief name for the system",
-  "domain": "string - the academic field (e.g., 'biology', 'physics', 'economics')",
-  "entities": ["string"] - key components or actors in the system,
-  "state_variables": ["string"] - variables that describe the system state,
-  "optimization_goal": "string - what the system optimizes for",
-  "constraints": ["string"] - limitations or constraints on the system,
-  "failure_modes": ["string"] - ways the system can fail or break down,
-  "key_equations_or_principles": ["string"] - core mathematical or conceptual principles,
-  "plain_language_summary": "string - 2-3 sentence summary in plain language"
-}
-
-CRITICAL: 
-- Strip all field-specific jargon
-- Focus on structural patterns, not domain details
-- Output ONLY the JSON object, no markdown, no explanations
-- Ensure all fields are populated (use empty arrays/strings if needed)
-- The schema must be valid JSON that can be parsed directly"""
-
-        user_prompt = f"""Analyze the following academic paper and extract its structural schema.
-
-Title: {paper_title}
-
-Paper Text:
-{paper_text[:8000]}  # Limit to avoid token limits
-
-Extract the structural schema following the format specified. Focus on the SYSTEM STRUCTURE, not domain-specific terminology."""
-
+        system_prompt, user_prompt = self._structural_abstraction_prompts(paper_text, paper_title)
         result = self._make_request(
             step_name="structural_abstraction",
             prompt=user_prompt,
             system_prompt=system_prompt,
             temperature=0.2,  # Lower temperature for more consistent schema extraction
-            max_tokens=1500
+            max_tokens=1500,
+            bypass_cache=bypass_cache,
+            stream=Config.KEYWORDS_STREAM,
+            on_token=_require_json_start(on_token),
+            validate=self._parse_schema  # Never cache a response that fails to parse
         )
+        return self._parse_schema(result)
+    
+    async def structural_abstraction_batch(
+        self,
+        papers: List[Dict[str, str]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Step B for several papers at once.
+        All gateway calls run concurrently over one pooled HTTP/2 client, so
+        wall time is roughly that of the slowest call rather than the sum.
         
+        Args:
+            papers: List of {"text": ..., "title": ...} dicts
+            
+        Returns:
+            List of {'schema', 'metadata'} dicts, in the same order as papers
+        """
+        async with self._async_client() as client:
+            return await asyncio.gather(*[
+                self._structural_abstraction_async(client, p["text"], p.get("title", ""))
+                for p in papers
+            ])
+    
+    def structural_abstraction_batch_sync(
+        self,
+        papers: List[Dict[str, str]]
+    ) -> List[Dict[str, Any]]:
+        """Run structural_abstraction_batch from synchronous code."""
+        return asyncio.run(self.structural_abstraction_batch(papers))
+    
+    async def _structural_abstraction_async(
+        self,
+        client: httpx.AsyncClient,
+        paper_text: str,
+        paper_title: str = ""
+    ) -> Dict[str, Any]:
+        """Async variant of structural_abstraction for batch processing."""
+        system_prompt, user_prompt = self._structural_abstraction_prompts(paper_text, paper_title)
+        result = await self._make_request_async(
+            client,
+            step_name="structural_abstraction",
+            prompt=user_prompt,
+            system_prompt=system_prompt,
+            temperature=0.2,
+            max_tokens=1500,
+            validate=self._parse_schema
+        )
+        return self._parse_schema(result)
+    
+    def _structural_abstraction_prompts(self, paper_text: str, paper_title: str):
+        """Build the (system_prompt, user_prompt) pair for structural abstraction."""
+        # Limit the paper text to a token budget to avoid context limits
+        user_prompt = "".join((
+            _STRUCTURAL_USER_PREFIX,
+            paper_title,
+            _STRUCTURAL_USER_MIDDLE,
+            _truncate_to_tokens(paper_text, Config.ABSTRACTION_INPUT_TOKENS)
+        ))
+        return _STRUCTURAL_SYSTEM_PROMPT, user_prompt
+    
+    def _parse_schema(self, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Parse and validate the structural schema from an abstraction response."""
         # Parse JSON from response
-        content = result["content"].strip()
-        
         # Remove markdown code blocks if present
-        if content.startswith("```json"):
-            content = content[7:]
-        if content.startswith("```"):
-            content = content[3:]
-        if content.endswith("```"):
-            content = content[:-3]
-        content = content.strip()
+        content = result["content"]
+        fenced = _FENCE_RE.match(content)
+        content = fenced.group(1) if fenced else content.strip()
         
         try:
-            schema = json.loads(content)
+            try:
+                schema = orjson.loads(content)
+            except orjson.JSONDecodeError:
+                # stdlib json tolerates non-standard output such as NaN/Infinity
+                schema = json.loads(content)
         except json.JSONDecodeError as e:
-            print(f"[ERROR] Failed to parse schema JSON: {e}")
-            print(f"[DEBUG] Response content: {content[:500]}")
+            logger.error("Failed to parse schema JSON: %s", e)
+            logger.debug("Response content: %s", content[:500])
             raise ValueError(f"Invalid JSON schema returned: {e}")
         
-        # Validate schema has required fields
-        required_fields = [
-            "system_name", "domain", "entities", "state_variables",
-            "optimization_goal", "constraints", "failure_modes",
-            "key_equations_or_principles", "plain_language_summary"
-        ]
-        for field in required_fields:
-            if field not in schema:
-                schema[field] = "" if isinstance(schema.get(field, ""), str) else []
+        # Fill in any missing required fields with typed empty defaults
+        schema = {
+            **{k: list(v) if isinstance(v, tuple) else v for k, v in _SCHEMA_DEFAULTS.items()},
+            **schema
+        }
         
         return {
             "schema": schema,
@@ -238,44 +805,68 @@ Extract the structural schema following the format specified. Focus on the SYSTE
         Returns:
             Dictionary with 'explanation' and 'metadata'
         """
-        system_prompt = """You are an expert at identifying structural analogies between systems from different academic domains.
-
-Your task is to explain why two systems might be structurally analogous despite being from different fields. Focus on:
-- Similar optimization goals
-- Similar constraints
-- Similar state variables
-- Similar failure modes
-- Structural patterns, not domain-specific details
-
-Write a clear, concise explanation (2-3 paragraphs) that a researcher could use to understand the cross-disciplinary connection."""
-
-        user_prompt = f"""Explain why these two systems might be structurally analogous:
-
-SOURCE SYSTEM ({source_schema.get('domain', 'unknown')}):
-- System: {source_schema.get('system_name', 'unknown')}
-- Optimization Goal: {source_schema.get('optimization_goal', 'N/A')}
-- Constraints: {', '.join(source_schema.get('constraints', []))}
-- State Variables: {', '.join(source_schema.get('state_variables', []))}
-- Failure Modes: {', '.join(source_schema.get('failure_modes', []))}
-
-TARGET SYSTEM ({target_schema.get('domain', 'unknown')}):
-- System: {target_schema.get('system_name', 'unknown')}
-- Optimization Goal: {target_schema.get('optimization_goal', 'N/A')}
-- Constraints: {', '.join(target_schema.get('constraints', []))}
-- State Variables: {', '.join(target_schema.get('state_variables', []))}
-- Failure Modes: {', '.join(target_schema.get('failure_modes', []))}
-
-Generate an explanation of the structural analogy."""
+        start_time = time.time()
+        fingerprint = _schema_fingerprint(source_schema) + b"\n" + _schema_fingerprint(target_schema)
+        cache_key = hashlib.sha256(fingerprint).hexdigest()
+        
+        if Config.KEYWORDS_CACHE_ENABLED:
+            cached = self._explanation_cache.get(cache_key)
+            if cached is not None:
+                return self._cached_explanation(cached, start_time)
+        
+        fingerprint_embedding = None
+        if Config.KEYWORDS_CACHE_ENABLED and Config.EXPLANATION_SEMANTIC_CACHE:
+            fingerprint_embedding = self._get_embedding_service().embed_text(fingerprint.decode())
+            cached = self._semantic_cache.get(fingerprint_embedding)
+            if cached is not None:
+                # Backfill L1 so the exact pair hits without an embedding call next time
+                self._explanation_cache.set(cache_key, cached)
+                return self._cached_explanation(cached, start_time)
+        
+        user_prompt = _EXPLANATION_USER_TEMPLATE.format(
+            src=_prompt_fields(source_schema),
+            tgt=_prompt_fields(target_schema)
+        )
 
         result = self._make_request(
             step_name="explanation_generation",
             prompt=user_prompt,
-            system_prompt=system_prompt,
+            system_prompt=_EXPLANATION_SYSTEM_PROMPT,
             temperature=0.7,  # Higher temperature for more natural explanations
             max_tokens=800
         )
         
-        return {
+        explanation = {
             "explanation": result["content"],
             "metadata": result["metadata"]
         }
+        if Config.KEYWORDS_CACHE_ENABLED:
+            self._explanation_cache.set(cache_key, explanation)
+            if fingerprint_embedding is not None:
+                self._semantic_cache.set(fingerprint_embedding, explanation)
+        return explanation
+    
+    def _cached_explanation(self, cached: Dict[str, Any], start_time: float) -> Dict[str, Any]:
+        """Return a cached explanation with per-call metadata."""
+        return {
+            "explanation": cached["explanation"],
+            "metadata": {
+                **cached["metadata"],
+                "latency": time.time() - start_time,
+                "cached": True
+            }
+        }
+    
+    def _get_embedding_service(self):
+        """Create the embedding client for the semantic cache on first use."""
+        if self._embedding_service is None:
+            from services.embedding_service import EmbeddingService
+            self._embedding_service = EmbeddingService()
+        return self._embedding_service
+
+@lru_cache(maxsize=1)
+def get_gateway() -> KeywordsGateway:
+    """Get the process-wide gateway, so its session pool and caches are shared."""
+    gateway = KeywordsGateway()
+    atexit.register(gateway.close)
+    return gateway
@@ -1,56 +1,143 @@
 """
 PDF processing service for extracting text from uploaded PDFs.
-Supports multiple PDF libraries (pdfplumber and PyPDF2).
+Supports multiple PDF libraries (pypdfium2, pdfplumber and PyPDF2).
 """
+import io
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
 import PyPDF2
 import pdfplumber
-from typing import Dict, List
-import io
+import pypdfium2 as pdfium
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+from typing import BinaryIO, Dict, Iterator, List, Optional, Union
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Sentence end: terminal punctuation followed by whitespace (matched on UTF-8 bytes)
+_SENT_BOUND = re.compile(rb'[.!?]\s')
+
+# Below this page count, extraction is faster than shipping the PDF to workers
+_PARALLEL_MIN_PAGES = 16
+
+# pdfium is not thread-safe: every in-process call (open, extract, close) must
+# hold this lock. Worker processes are single-threaded and need no lock.
+_pdfium_lock = threading.Lock()
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _get_pool() -> ProcessPoolExecutor:
+    """
+    Lazily start the shared page-extraction worker pool.
+    
+    Workers come from a forkserver rather than fork(): this process already
+    runs logging, ingest and HTTP threads, and forking it could copy a held
+    lock into a child and deadlock it. The fork server preloads only this
+    module. Workers also re-import the main module, which must therefore be
+    free of import-time side effects (see create_app in app.py).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload([__name__])
+            _pool = ProcessPoolExecutor(max_workers=Config.PDF_WORKERS, mp_context=context)
+        return _pool
+
+def _char_start(buf: bytes, offset: int) -> int:
+    """Move a byte offset back to the start of the UTF-8 character containing it."""
+    while 0 < offset < len(buf) and buf[offset] & 0xC0 == 0x80:
+        offset -= 1
+    return offset
+
+def _page_texts(pdf: "pdfium.PdfDocument", start: int, stop: int) -> List[str]:
+    """Extract the non-empty text of pages [start, stop) of an open document."""
+    text_parts = []
+    for index in range(start, stop):
+        page = pdf[index]
+        textpage = page.get_textpage()
+        page_text = textpage.get_text_range()
+        textpage.close()
+        page.close()
+        if page_text.strip():
+            # pdfium separates lines with CRLF
+            text_parts.append(page_text.replace("\r\n", "\n"))
+    return text_parts
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Worker entry point: open the PDF file and extract one page range."""
+    pdf = pdfium.PdfDocument(path)
+    try:
+        return _page_texts(pdf, start, stop)
+    finally:
+        pdf.close()
 
 class PDFProcessor:
     """Service for processing PDF files and extracting text."""
     
-    def extract_text_from_pdf(self, pdf_file: bytes, title: str = "") -> Dict[str, any]:
+    def extract_text_from_pdf(
+        self,
+        pdf_file: Union[BinaryIO, bytes],
+        title: str = "",
+        high_fidelity: bool = False
+    ) -> Dict[str, any]:
         """
         Step A: PDF Ingestion
         Extract text from PDF file and chunk it.
         
         Args:
-            pdf_file: PDF file bytes
+            pdf_file: Seekable binary file object (read in place, never copied)
+                or raw PDF bytes
             title: Optional paper title
+            high_fidelity: Prefer pdfplumber's layout reconstruction (slower,
+                better for tables and multi-column layouts) over pdfium
             
         Returns:
             Dictionary with 'text' (full text), 'chunks' (list of chunks), and 'title'
         """
-        # Try pdfplumber first (better for complex layouts)
-        try:
-            pdf = pdfplumber.open(io.BytesIO(pdf_file))
-            text_parts = []
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text_parts.append(page_text)
-            full_text = "\n\n".join(text_parts)
-            pdf.close()
-        except Exception as e:
-            print(f"[WARNING] pdfplumber failed, trying PyPDF2: {e}")
-            # Fallback to PyPDF2
+        if isinstance(pdf_file, (bytes, bytearray)):
+            # Wrapped once; every extractor below rewinds the same buffer
+            pdf_file = io.BytesIO(pdf_file)
+        
+        # Reject oversized uploads before any parser touches them
+        size = pdf_file.seek(0, io.SEEK_END)
+        if size > Config.MAX_PDF_BYTES:
+            raise ValueError(
+                f"PDF is too large ({size} bytes, limit {Config.MAX_PDF_BYTES})"
+            )
+        
+        # pdfium (native) is the fast default; PyPDF2 is only a last resort
+        extractors = [
+            ("pypdfium2", self._extract_with_pdfium),
+            ("pdfplumber", self._extract_with_pdfplumber)
+        ]
+        if high_fidelity:
+            extractors.reverse()
+        extractors.append(("PyPDF2", self._extract_with_pypdf2))
+        
+        full_text = None
+        for name, extract in extractors:
             try:
-                pdf = PyPDF2.PdfReader(io.BytesIO(pdf_file))
-                text_parts = []
-                for page in pdf.pages:
-                    page_text = page.extract_text()
-                    if page_text:
-                        text_parts.append(page_text)
-                full_text = "\n\n".join(text_parts)
-            except Exception as e2:
-                raise ValueError(f"Failed to extract text from PDF: {e2}")
+                pdf_file.seek(0)
+                full_text = extract(pdf_file)
+                break
+            except Exception as e:
+                if name == "PyPDF2":
+                    raise ValueError(f"Failed to extract text from PDF: {e}")
+                logger.warning("%s failed, trying next extractor: %s", name, e)
         
         if not full_text or len(full_text.strip()) < 100:
             raise ValueError("PDF appears to be empty or unreadable")
         
         # Chunk the text (simple chunking by paragraphs/sentences)
-        chunks = self._chunk_text(full_text)
+        chunks = list(self._chunk_text(full_text))
         
         return {
             "text": full_text,
@@ -58,45 +145,103 @@ class PDFProcessor:
             "title": title or self._extract_title_from_text(full_text)
         }
     
-    def _chunk_text(self, text: str, chunk_size: int = 2000, overlap: int = 200) -> List[str]:
+    def _extract_with_pdfium(self, pdf_file: BinaryIO) -> str:
+        """
+        Extract plain text with pypdfium2.
+        
+        Long documents are split into page ranges extracted in worker
+        processes; pdfium is not thread-safe, so threads cannot be used and
+        in-process extraction is serialized by _pdfium_lock.
+        """
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_file)
+            try:
+                page_count = len(pdf)
+                if page_count < _PARALLEL_MIN_PAGES or Config.PDF_WORKERS < 2:
+                    return "\n\n".join(_page_texts(pdf, 0, page_count))
+            finally:
+                pdf.close()
+        
+        # Workers open a temp copy of the file by path instead of each being
+        # sent a pickled copy of the bytes
+        pdf_file.seek(0)
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+            shutil.copyfileobj(pdf_file, tmp)
+        try:
+            workers = Config.PDF_WORKERS
+            bounds = [page_count * i // workers for i in range(workers + 1)]
+            # map yields results in submission order, so page order is kept
+            ranges = _get_pool().map(_extract_page_range, repeat(tmp.name), bounds[:-1], bounds[1:])
+            return "\n\n".join(text for part in ranges for text in part)
+        finally:
+            os.unlink(tmp.name)
+    
+    def _extract_with_pdfplumber(self, pdf_file: BinaryIO) -> str:
+        """Extract text with pdfplumber's layout-aware extraction."""
+        pdf = pdfplumber.open(pdf_file)
+        try:
+            text_parts = []
+            for page in pdf.pages:
+                page_text = page.extract_text()
+                if page_text:
+                    text_parts.append(page_text)
+            return "\n\n".join(text_parts)
+        finally:
+            pdf.close()
+    
+    def _extract_with_pypdf2(self, pdf_file: BinaryIO) -> str:
+        """Extract text with PyPDF2."""
+        pdf = PyPDF2.PdfReader(pdf_file)
+        text_parts = []
+        for page in pdf.pages:
+            page_text = page.extract_text()
+            if page_text:
+                text_parts.append(page_text)
+        return "\n\n".join(text_parts)
+    
+    def _chunk_text(self, text: str, chunk_size: int = 2000, overlap: int = 200) -> Iterator[str]:
         """
         Chunk text into smaller pieces for processing.
         
+        Works on a memoryview of the UTF-8 encoded text, so each chunk is
+        decoded straight from the shared buffer instead of slicing copies.
+        
         Args:
             text: Full text
-            chunk_size: Target chunk size in characters
-            overlap: Overlap between chunks
+            chunk_size: Target chunk size in bytes (characters for ASCII text)
+            overlap: Overlap between chunks, in bytes
             
-        Returns:
-            List of text chunks
+        Yields:
+            Text chunks, in order
         """
-        chunks = []
+        buf = text.encode("utf-8")
+        view = memoryview(buf)
+        length = len(buf)
         start = 0
         
-        while start < len(text):
+        while start < length:
             end = start + chunk_size
             
-            # Try to break at sentence boundary
-            if end < len(text):
-                # Look for sentence endings
-                for punct in ['. ', '.\n', '! ', '!\n', '? ', '?\n']:
-                    last_punct = text.rfind(punct, start, end)
-                    if last_punct != -1:
-                        end = last_punct + 2
-                        break
+            # Try to break at the last sentence boundary in the window; boundaries
+            # inside the overlap are skipped so the next chunk always moves forward
+            if end < length:
+                last_match = None
+                for last_match in _SENT_BOUND.finditer(buf, start + overlap, end):
+                    pass
+                end = last_match.end() if last_match else _char_start(buf, end)
             
-            chunk = text[start:end].strip()
+            chunk = str(view[start:end], "utf-8").strip()
             if chunk:
-                chunks.append(chunk)
+                yield chunk
             
-            start = end - overlap
-        
-        return chunks
+            if end >= length:
+                break
+            start = _char_start(buf, end - overlap)
     
     def _extract_title_from_text(self, text: str) -> str:
         """Extract title from text (first line or first sentence)."""
-        lines = text.split('\n')
-        for line in lines[:10]:  # Check first 10 lines
+        # Only the first page or so can hold the title; avoid splitting the whole text
+        for line in islice(text[:4096].splitlines(), 10):  # Check first 10 lines
             line = line.strip()
             if line and len(line) > 10 and len(line) < 200:
                 return line
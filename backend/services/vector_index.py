@@ -0,0 +1,145 @@
+"""
+In-memory FAISS HNSW index over paper embeddings.
+Used for structural retrieval when the match_papers RPC is not installed,
+so single-process deployments still get sub-linear search.
+"""
+import threading
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    # Optional dependency: without it the agent uses the NumPy scan instead
+    faiss = None
+
+def to_float32(embedding: Union[List[float], str]) -> np.ndarray:
+    """
+    Convert a stored embedding to a float32 vector.
+    PostgREST returns vector columns as '[x,y,...]' strings; these are parsed
+    straight into float32 instead of via a list of Python (float64) floats.
+    """
+    if isinstance(embedding, str):
+        return np.fromstring(embedding.strip("[]"), dtype=np.float32, sep=",")
+    return np.asarray(embedding, dtype=np.float32)
+
+class PaperIndex:
+    """
+    Lazily-built HNSW index mapping FAISS row ids back to papers.
+    Embeddings are unit-length, so inner product equals cosine similarity.
+    """
+    
+    def __init__(self, db, m: int = 32, ef_construction: int = 128, ef_search: int = 64):
+        self.db = db
+        self.m = m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._index = None
+        self._papers: List[Dict[str, Any]] = []  # Position i holds the paper for FAISS id i
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def is_available() -> bool:
+        """Whether faiss is installed."""
+        return faiss is not None
+    
+    def search(
+        self,
+        query_embedding: Union[List[float], str],
+        top_k: int,
+        exclude_domain: Optional[str] = None,
+        exclude_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Find the top_k most similar papers, skipping exclude_domain.
+        
+        Args:
+            query_embedding: Unit-length query vector
+            top_k: Number of results to return
+            exclude_domain: Optional domain to exclude
+            exclude_id: Optional paper ID to exclude (the query paper itself)
+            
+        Returns:
+            List of matched papers with similarity scores
+        """
+        with self._lock:
+            if self._index is None:
+                self._build()
+            if not self._papers:
+                return []
+            
+            # Over-fetch by the number of excluded papers so filtering
+            # in Python still leaves top_k results
+            excluded = 1 if exclude_id else 0
+            if exclude_domain:
+                excluded += sum(1 for p in self._papers if p.get("domain") == exclude_domain)
+            k = min(len(self._papers), top_k + excluded)
+            
+            self._index.hnsw.efSearch = max(self.ef_search, k)
+            query = to_float32(query_embedding).reshape(1, -1)
+            scores, ids = self._index.search(query, k)
+            papers = self._papers
+        
+        matches = []
+        for score, idx in zip(scores[0], ids[0]):
+            if idx < 0:
+                continue
+            paper = papers[idx]
+            if exclude_domain and paper.get("domain") == exclude_domain:
+                continue
+            if exclude_id and paper["id"] == exclude_id:
+                continue
+            matches.append({
+                "paper_id": paper["id"],
+                "title": paper.get("title"),
+                "domain": paper.get("domain"),
+                "schema": paper.get("structural_schema"),
+                "similarity_score": float(score)
+            })
+            if len(matches) == top_k:
+                break
+        
+        return matches
+    
+    def add(self, paper: Dict[str, Any], embedding: List[float]):
+        """Append a newly stored paper to the index if it has been built."""
+        with self._lock:
+            # An unbuilt index will pick the paper up from the database
+            if self._index is None:
+                return
+            self._index.add(to_float32(embedding).reshape(1, -1))
+            self._papers.append(paper)
+    
+    def invalidate(self):
+        """Drop the index so it is rebuilt from the database on next search."""
+        with self._lock:
+            self._index = None
+            self._papers = []
+    
+    def _build(self):
+        """Load all embeddings from the database and build the HNSW graph."""
+        response = self.db.table("papers").select(
+            "id, title, domain, structural_schema, structural_embedding"
+        ).execute()
+        
+        papers = []
+        vectors = []
+        for paper in response.data:
+            embedding = paper.pop("structural_embedding", None)
+            if not embedding:
+                continue
+            papers.append(paper)
+            vectors.append(to_float32(embedding))
+        
+        if not vectors:
+            self._papers = []
+            return
+        
+        matrix = np.stack(vectors)
+        index = faiss.IndexHNSWFlat(matrix.shape[1], self.m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = self.ef_construction
+        index.add(matrix)
+        
+        self._index = index
+        self._papers = papers